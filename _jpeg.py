@@ -0,0 +1,77 @@
+import os
+import threading
+from PIL import Image
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+# =========================
+# libjpeg-turbo decode (optional)
+# =========================
+
+_tj = None
+_tj_lock = threading.Lock()
+
+# per-thread read buffer, only created once libjpeg-turbo is actually used
+_local = threading.local()
+
+
+def _instance():
+    # one shared handle, the TurboJPEG decoder is thread-safe
+    global _tj
+    if _tj is None and TurboJPEG is not None:
+        with _tj_lock:
+            if _tj is None:
+                try:
+                    _tj = TurboJPEG()
+                except (OSError, RuntimeError):
+                    _tj = False
+    return _tj or None
+
+
+def available():
+    return _instance() is not None
+
+
+def _scaling_factor(tj, buf, max_dim):
+    # largest 1/2, 1/4, 1/8 IDCT reduction that stays >= max_dim
+    w, h = tj.decode_header(buf)[:2]
+    for denom in (8, 4, 2):
+        if (1, denom) in tj.scaling_factors and max(w, h) // denom >= max_dim:
+            return (1, denom)
+    return None
+
+
+def decode(path, max_dim=0):
+    """Decode a JPEG with libjpeg-turbo, None if it can't be used.
+
+    The file is read into a per-thread buffer that grows to the largest
+    input seen, instead of into a fresh bytes object. With `max_dim` set
+    the decoder scales down during the IDCT, the result is still at least
+    `max_dim` on its longer side.
+    """
+    tj = _instance()
+    if tj is None:
+        return None
+
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        scratch = getattr(_local, "scratch", None)
+        if scratch is None:
+            scratch = _local.scratch = bytearray(size)
+        elif len(scratch) < size:
+            scratch.extend(bytes(size - len(scratch)))
+        view = memoryview(scratch)[:size]
+        buf = view[:fh.readinto(view)]
+
+    try:
+        scale = _scaling_factor(tj, buf, max_dim) if max_dim else None
+        arr = tj.decode(buf, pixel_format=TJPF_RGB, scaling_factor=scale)
+    except OSError:
+        # e.g. CMYK JPEGs, let Pillow deal with those
+        return None
+
+    h, w = arr.shape[:2]
+    return Image.frombuffer("RGB", (w, h), arr, "raw", "RGB", 0, 1)
@@ -0,0 +1,205 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+
+# =========================
+# libwebp binding (advanced encode API)
+# =========================
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+if sys.platform == "win32":
+    _LOCAL = ("libwebp.dll",)
+elif sys.platform == "darwin":
+    _LOCAL = ("libwebp.dylib",)
+else:
+    _LOCAL = ("libwebp.so", "libwebp.so.7")
+
+# only the major byte is checked by libwebp (any 1.x release)
+_ENCODER_ABI_VERSION = 0x020f
+
+_c_int = ctypes.c_int
+_c_float = ctypes.c_float
+_c_u32 = ctypes.c_uint32
+_c_void_p = ctypes.c_void_p
+
+
+class WebPConfig(ctypes.Structure):
+    _fields_ = [
+        ("lossless", _c_int), ("quality", _c_float), ("method", _c_int),
+        ("image_hint", _c_int), ("target_size", _c_int),
+        ("target_PSNR", _c_float), ("segments", _c_int),
+        ("sns_strength", _c_int), ("filter_strength", _c_int),
+        ("filter_sharpness", _c_int), ("filter_type", _c_int),
+        ("autofilter", _c_int), ("alpha_compression", _c_int),
+        ("alpha_filtering", _c_int), ("alpha_quality", _c_int),
+        ("pass_", _c_int), ("show_compressed", _c_int),
+        ("preprocessing", _c_int), ("partitions", _c_int),
+        ("partition_limit", _c_int), ("emulate_jpeg_size", _c_int),
+        ("thread_level", _c_int), ("low_memory", _c_int),
+        ("near_lossless", _c_int), ("exact", _c_int),
+        ("use_delta_palette", _c_int), ("use_sharp_yuv", _c_int),
+        ("qmin", _c_int), ("qmax", _c_int),
+    ]
+
+
+class WebPPicture(ctypes.Structure):
+    _fields_ = [
+        ("use_argb", _c_int), ("colorspace", _c_int),
+        ("width", _c_int), ("height", _c_int),
+        ("y", _c_void_p), ("u", _c_void_p), ("v", _c_void_p),
+        ("y_stride", _c_int), ("uv_stride", _c_int),
+        ("a", _c_void_p), ("a_stride", _c_int),
+        ("pad1", _c_u32 * 2),
+        ("argb", _c_void_p), ("argb_stride", _c_int),
+        ("pad2", _c_u32 * 3),
+        ("writer", _c_void_p), ("custom_ptr", _c_void_p),
+        ("extra_info_type", _c_int), ("extra_info", _c_void_p),
+        ("stats", _c_void_p), ("error_code", _c_int),
+        ("progress_hook", _c_void_p), ("user_data", _c_void_p),
+        ("pad3", _c_u32 * 3),
+        ("pad4", _c_void_p), ("pad5", _c_void_p),
+        ("pad6", _c_u32 * 8),
+        ("memory_", _c_void_p), ("memory_argb_", _c_void_p),
+        ("pad7", _c_void_p * 2),
+    ]
+
+
+class WebPMemoryWriter(ctypes.Structure):
+    _fields_ = [
+        ("mem", ctypes.POINTER(ctypes.c_uint8)),
+        ("size", ctypes.c_size_t),
+        ("max_size", ctypes.c_size_t),
+        ("pad", _c_u32 * 1),
+    ]
+
+
+_ERRORS = (
+    "ok", "out of memory", "bitstream out of memory", "null parameter",
+    "invalid configuration", "bad dimension", "partition0 overflow",
+    "partition overflow", "bad write", "file too big", "user abort",
+)
+
+
+def _candidates():
+    # a libwebp dropped next to app.py wins over the system one
+    for name in _LOCAL:
+        yield os.path.join(_HERE, name)
+    for name in ("webp", "libwebp"):
+        path = ctypes.util.find_library(name)
+        if path:
+            yield path
+    yield from _LOCAL
+
+
+def _load():
+    for path in _candidates():
+        try:
+            # CDLL (not PyDLL) drops the GIL for the duration of each call
+            lib = ctypes.CDLL(path)
+            lib.WebPMemoryWriterClear
+        except (OSError, AttributeError):
+            continue
+
+        config_p = ctypes.POINTER(WebPConfig)
+        picture_p = ctypes.POINTER(WebPPicture)
+        writer_p = ctypes.POINTER(WebPMemoryWriter)
+
+        lib.WebPConfigInitInternal.argtypes = [config_p, _c_int, _c_float, _c_int]
+        lib.WebPValidateConfig.argtypes = [config_p]
+        lib.WebPPictureInitInternal.argtypes = [picture_p, _c_int]
+        for fn in (lib.WebPPictureImportRGB, lib.WebPPictureImportRGBA):
+            fn.argtypes = [picture_p, _c_void_p, _c_int]
+        lib.WebPPictureFree.argtypes = [picture_p]
+        lib.WebPPictureFree.restype = None
+        lib.WebPMemoryWriterInit.argtypes = [writer_p]
+        lib.WebPMemoryWriterInit.restype = None
+        lib.WebPMemoryWriterClear.argtypes = [writer_p]
+        lib.WebPMemoryWriterClear.restype = None
+        lib.WebPEncode.argtypes = [config_p, picture_p]
+        lib.WebPGetEncoderVersion.restype = _c_int
+        return lib
+    return None
+
+
+_lib = _load()
+_memory_write = _lib and ctypes.cast(_lib.WebPMemoryWrite, _c_void_p).value
+
+
+def available():
+    return _lib is not None
+
+
+def version():
+    if _lib is None:
+        return None
+    v = _lib.WebPGetEncoderVersion()
+    return f"{v >> 16}.{(v >> 8) & 0xff}.{v & 0xff}"
+
+
+class Encoder:
+    """Reusable encoder: the config is validated once and libwebp's output
+    buffer is kept between files instead of being freed and regrown.
+
+    Not thread-safe, use one per worker thread.
+    """
+
+    def __init__(self, quality, method=4):
+        self.quality = quality
+        self.method = method
+
+        # set up first so __del__ always has something to clear
+        self._writer = WebPMemoryWriter()
+        _lib.WebPMemoryWriterInit(ctypes.byref(self._writer))
+
+        self._config = WebPConfig()
+        if not _lib.WebPConfigInitInternal(ctypes.byref(self._config), 0,
+                                           float(quality), _ENCODER_ABI_VERSION):
+            raise RuntimeError("libwebp version mismatch")
+        self._config.method = method
+        if not _lib.WebPValidateConfig(ctypes.byref(self._config)):
+            raise RuntimeError("invalid libwebp configuration")
+
+    def __del__(self):
+        if _lib is not None:
+            _lib.WebPMemoryWriterClear(ctypes.byref(self._writer))
+
+    def save(self, img, path):
+        """Encode a Pillow image to `path`, return bytes written."""
+        if img.mode in ("LA", "PA") or (img.mode != "RGBA" and "transparency" in img.info):
+            img = img.convert("RGBA")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+
+        pic = WebPPicture()
+        if not _lib.WebPPictureInitInternal(ctypes.byref(pic), _ENCODER_ABI_VERSION):
+            raise RuntimeError("libwebp version mismatch")
+        pic.width, pic.height = img.size
+
+        # rewind, WebPMemoryWrite only reallocates past max_size
+        writer = self._writer
+        writer.size = 0
+        pic.writer = _memory_write
+        pic.custom_ptr = ctypes.addressof(writer)
+
+        try:
+            if img.mode == "RGBA":
+                ok = _lib.WebPPictureImportRGBA(ctypes.byref(pic), img.tobytes(),
+                                                img.width * 4)
+            else:
+                ok = _lib.WebPPictureImportRGB(ctypes.byref(pic), img.tobytes(),
+                                               img.width * 3)
+            if not ok or not _lib.WebPEncode(ctypes.byref(self._config),
+                                             ctypes.byref(pic)):
+                code = pic.error_code
+                reason = _ERRORS[code] if 0 <= code < len(_ERRORS) else code
+                raise RuntimeError(f"libwebp encode failed ({reason})")
+
+            size = writer.size
+            buf = (ctypes.c_uint8 * size).from_address(ctypes.addressof(writer.mem.contents))
+            with open(path, "wb") as fh:
+                fh.write(memoryview(buf))
+        finally:
+            _lib.WebPPictureFree(ctypes.byref(pic))
+        return size
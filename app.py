@@ -1,12 +1,25 @@
 import os
+import re
 import json
 import time
+import struct
 import threading
-from PIL import Image
+import logging
+import queue
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import _jpeg
+import _webp
 
 from PyQt5.QtCore import (
-    Qt, QObject, QRunnable, QThreadPool,
-    pyqtSignal, QSettings
+    Qt, QObject, QTimer, pyqtSignal, QSettings
 )
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
@@ -14,79 +27,174 @@ from PyQt5.QtWidgets import (
     QCheckBox, QSlider, QProgressBar, QSpinBox
 )
 
-def safe_remove(path, retries=3):
-    for _ in range(retries):
-        try:
-            os.remove(path)
-            return
-        except PermissionError:
-            time.sleep(0.1)
-    os.remove(path)
-# =========================
-# Worker Task
-# =========================
+# orjson reads integers outside 64 bits as floats, leave long digit runs
+# to json so they round-trip exactly
+_LONG_DIGITS = re.compile(r"\d{19}")
 
-class ConvertTask(QRunnable):
 
-    def __init__(self, controller, img_path):
-        super().__init__()
-        self.controller = controller
-        self.img_path = img_path
+def _orjson_dumps(obj):
+    s = orjson.dumps(obj).decode()
+    # \u escapes in the input come back as raw characters, EXIF text is ASCII
+    return s if s.isascii() else json.dumps(obj)
 
-    def run(self):
-        ctrl = self.controller
 
-        # Pause handling
-        with ctrl.pause_cond:
-            while ctrl.paused:
-                ctrl.pause_cond.wait()
+def _parse_workflow(text):
+    # parsed workflow plus the dumper that turns it back into ASCII JSON;
+    # non-ASCII text goes straight to json, which escapes it in one pass
+    if orjson is not None and text.isascii() and not _LONG_DIGITS.search(text):
+        try:
+            return orjson.loads(text), _orjson_dumps
+        except orjson.JSONDecodeError:
+            # NaN/Infinity, json accepts those
+            pass
+    return json.loads(text), json.dumps
 
-        # Cancel check AFTER pause
-        if ctrl.cancelled:
-            return
 
-        webp_size = 0  # ensures safe scope
+log = logging.getLogger(__name__)
 
-        try:
-            orig_size = os.path.getsize(self.img_path)
+_CPU_COUNT = os.cpu_count() or 1
 
-            with Image.open(self.img_path) as img:
-                img.load()  # 🔑 required on Windows
+# stock Pillow wheels may ship a plain libjpeg, see README
+PILLOW_JPEG_TURBO = bool(features.check_feature("libjpeg_turbo"))
+if not PILLOW_JPEG_TURBO:
+    log.warning("Pillow is not built against libjpeg-turbo, JPEG decoding will be slow")
 
-                base = os.path.splitext(os.path.basename(self.img_path))[0]
-                output_path = ctrl.resolve_name(base)
 
-                if ctrl.keep_metadata:
-                    ctrl.save_with_metadata(img, self.img_path, output_path)
-                else:
-                    img.save(output_path, "webp", quality=ctrl.quality)
+def backend_status():
+    if _jpeg.available():
+        jpeg = "libjpeg-turbo ✓ (PyTurboJPEG)"
+    elif PILLOW_JPEG_TURBO:
+        jpeg = "libjpeg-turbo ✓ (Pillow)"
+    else:
+        jpeg = "libjpeg-turbo ✗"
+    webp = f"libwebp {_webp.version()} ✓" if _webp.available() else "Pillow"
+    return f"JPEG backend: {jpeg}   WebP encoder: {webp}"
 
-            # ⬅ image file is FULLY CLOSED here
+def safe_remove(path, retries=20):
+    for _ in range(retries):
+        try:
+            os.unlink(path)
+            return
+        except PermissionError:
+            time.sleep(0.05)
+    os.unlink(path)
 
-            webp_size = os.path.getsize(output_path)
-            if webp_size <= 0:
-                raise RuntimeError("Empty WEBP")
+# same buffer size coreutils cp uses
+WRITE_BUFFER = 128 * 1024
 
-            if ctrl.delete_originals:
-                safe_remove(self.img_path)
 
-            ctrl.task_finished(orig_size, webp_size)
+class _WorkerEncoder(threading.local):
+    # one libwebp encoder per worker, rebuilt only when the settings change
 
-        except Exception as e:
-            ctrl.task_error(f"{os.path.basename(self.img_path)} → {e}")
+    def __init__(self):
+        self._encoder = None
+
+    def get(self, quality, method):
+        enc = self._encoder
+        if enc is None or enc.quality != quality or enc.method != method:
+            enc = self._encoder = _webp.Encoder(quality, method)
+        return enc
+
+
+_encoder = _WorkerEncoder()
+
+
+def open_image(path, max_dim=0):
+    if path.lower().endswith((".jpg", ".jpeg")):
+        img = _jpeg.decode(path, max_dim)
+        if img is not None:
+            return img
+
+    img = Image.open(path)
+    if max_dim and img.format == "JPEG":
+        # ask libjpeg to downscale in the IDCT, the result stays at least
+        # max_dim on its longer side
+        img.draft("RGB", (max_dim, max_dim))
+    return img
+
+
+def shrink_image(img, max_dim):
+    # thumbnail() can't reduce() I;16 and drops to NEAREST for P and 1, so
+    # convert first to what the encoder would turn the image into anyway
+    if img.mode not in ("RGB", "RGBA", "L"):
+        if img.mode in ("LA", "PA") or "transparency" in img.info:
+            img = img.convert("RGBA")
+        else:
+            img = img.convert("RGB")
+    img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    return img
+
+
+def save_webp(img, output_path, quality, method):
+    if _webp.available():
+        return _encoder.get(quality, method).save(img, output_path)
+
+    with open(output_path, "wb", buffering=WRITE_BUFFER) as fh:
+        img.save(fh, "webp", quality=quality, method=method)
+        fh.flush()
+        return os.fstat(fh.fileno()).st_size
+
+
+def workflow_exif(workflow):
+    # little-endian TIFF header + one IFD holding only ImageDescription
+    # (0x010e, ASCII), the payload follows the IFD at offset 26
+    text = ("Workflow:" + workflow).encode("ascii", "replace") + b"\0"
+    return struct.pack(
+        "<2sHIHHHIII",
+        b"II", 42, 8,               # header, IFD at offset 8
+        1,                          # one entry
+        0x010e, 2, len(text), 26,   # tag, type ASCII, count, offset
+        0                           # no next IFD
+    ) + text
+
+
+def save_with_metadata(img, output_path, quality, method):
+    # ComfyUI writes its text chunks before IDAT, so they are normally in
+    # img.info without decoding; chunks after IDAT only show up on load()
+    workflow = img.info.get("workflow")
+    if workflow is None:
+        img.load()
+        workflow = img.info.get("workflow")
+
+    # only re-serialize when there is something to strip or escape
+    if workflow and ("LoraInfo" in workflow or not workflow.isascii()):
+        try:
+            data, dumps = _parse_workflow(workflow)
+            data["nodes"] = [
+                n for n in data.get("nodes", [])
+                if n.get("type") != "LoraInfo"
+            ]
+            workflow = dumps(data)
+        except Exception:
+            pass
+
+    # raw EXIF bytes, no need to build a Pillow Exif object per file
+    exif = workflow_exif(workflow) if workflow else img.info.get("exif", b"")
+
+    # WebP keeps RGBA as is, only palette/grey/etc. need converting
+    target = img if img.mode in ("RGB", "RGBA") else img.convert("RGB")
+
+    with open(output_path, "wb", buffering=WRITE_BUFFER) as fh:
+        target.save(
+            fh, "webp",
+            quality=quality,
+            method=method,
+            exif=exif
+        )
+        fh.flush()
+        return os.fstat(fh.fileno()).st_size
 
 # =========================
 # Controller
 # =========================
 
 class JobController(QObject):
-    progress = pyqtSignal(int)
-    eta = pyqtSignal(str)
     finished = pyqtSignal(dict)
     error = pyqtSignal(str)
 
     def __init__(self, files, output_dir, quality,
-                 keep_metadata, delete_originals, max_workers):
+                 keep_metadata, delete_originals, max_workers, method=4,
+                 max_dim=0):
         super().__init__()
 
         self.files = files
@@ -94,96 +202,210 @@ class JobController(QObject):
         self.quality = quality
         self.keep_metadata = keep_metadata
         self.delete_originals = delete_originals
-
-        self.pool = QThreadPool.globalInstance()
-        self.pool.setMaxThreadCount(max_workers)
+        self.method = method
+        self.max_dim = max_dim
+
+        if keep_metadata:
+            self._encode = self._encode_meta
+        elif max_dim:
+            self._encode = self._encode_resized
+        else:
+            self._encode = self._encode_fast
+
+        # set while running, cleared while paused
+        self._go = threading.Event()
+        self._go.set()
+
+        # encode/decode run in ctypes calls that drop the GIL; a fixed set
+        # of long-lived workers pull paths from one queue
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._queue = queue.SimpleQueue()
+        for f in files:
+            self._queue.put(f)
+        self._active = 0
 
         self.total = len(files)
         self.completed = 0
+        self.failed = 0
         self.orig_bytes = 0
         self.webp_bytes = 0
+        self._counter_lock = threading.Lock()
 
         self.start_time = time.monotonic()
 
         self.cancelled = False
-        self.paused = False
-        self.pause_cond = threading.Condition()
+
+        # originals are deleted off the workers' critical path
+        self._delete_q = queue.SimpleQueue()
+        self._deleter = threading.Thread(target=self._delete_loop, daemon=True)
+        if delete_originals:
+            self._deleter.start()
+
+        # names already on disk plus the ones handed out this job
+        try:
+            existing = os.listdir(output_dir)
+        except OSError:
+            # missing/unreadable folder: each file reports the error itself
+            existing = []
+        self._taken = {os.path.normcase(n) for n in existing}
+        self._suffix = collections.defaultdict(int)
+        self._name_lock = threading.Lock()
 
     def start(self):
-        for f in self.files:
+        self._active = self.max_workers
+        for _ in range(self.max_workers):
+            self.pool.submit(self._work)
+
+    def _work(self):
+        # results are handed over in batches of up to 8,
+        # or whatever finished within 100 ms
+        converted = failed = orig = webp = 0
+        last_flush = time.monotonic()
+
+        while True:
+            # Pause handling: a cheap is_set() while running; when paused,
+            # report what this worker has done so far before blocking
+            if not self._go.is_set():
+                if converted or failed:
+                    self.task_finished(converted, failed, orig, webp)
+                    converted = failed = orig = webp = 0
+                self._go.wait()
+
+            # Cancel check AFTER pause
             if self.cancelled:
                 break
-            self.pool.start(ConvertTask(self, f))
+
+            try:
+                img_path = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            orig_size, webp_size, error = self.convert_one(img_path)
+            if error:
+                self.task_error(error)
+                failed += 1
+            else:
+                converted += 1
+                orig += orig_size
+                webp += webp_size
+
+            now = time.monotonic()
+            if converted + failed >= 8 or now - last_flush >= 0.1:
+                self.task_finished(converted, failed, orig, webp)
+                converted = failed = orig = webp = 0
+                last_flush = now
+
+        if converted or failed:
+            self.task_finished(converted, failed, orig, webp)
+
+        with self._counter_lock:
+            self._active -= 1
+            last = self._active == 0
+        if last:
+            self._job_done()
+
+    def _job_done(self):
+        self.pool.shutdown(wait=False)
+
+        # wait for the queued deletes before reporting the job as done
+        if self._deleter.is_alive():
+            self._delete_q.put(None)
+            self._deleter.join()
+
+        if self.completed + self.failed == self.total:
+            self.finished.emit({
+                "converted": self.completed,
+                "failed": self.failed,
+                "saved_bytes": self.orig_bytes - self.webp_bytes
+            })
+
+    def _delete_loop(self):
+        while True:
+            path = self._delete_q.get()
+            if path is None:
+                return
+            try:
+                # retries while an indexer/AV scanner still holds the file
+                safe_remove(path)
+            except OSError as e:
+                self.task_error(f"{os.path.basename(path)} → {e}")
 
     def pause(self):
-        with self.pause_cond:
-            self.paused = True
+        self._go.clear()
 
     def resume(self):
-        with self.pause_cond:
-            self.paused = False
-            self.pause_cond.notify_all()
+        self._go.set()
 
-    def cancel(self):
-        self.cancelled = True
+    def convert_one(self, img_path):
+        try:
+            orig_size = os.stat(img_path).st_size
 
-    def resolve_name(self, base):
-        path = os.path.join(self.output_dir, f"{base}.webp")
-        i = 1
-        while os.path.exists(path):
-            path = os.path.join(self.output_dir, f"{base}_{i}.webp")
-            i += 1
-        return path
-
-    def save_with_metadata(self, img, img_path, output_path):
-        if not img_path.lower().endswith(".png"):
-            raise ValueError("Workflow requires PNG")
+            webp_size = self._encode(img_path)
+            if webp_size <= 0:
+                raise RuntimeError("Empty WEBP")
 
-        info = img.info.copy()
-        workflow = info.get("workflow")
+            if self.delete_originals:
+                self._delete_q.put(img_path)
 
-        if workflow:
-            try:
-                data = json.loads(workflow)
-                data["nodes"] = [
-                    n for n in data.get("nodes", [])
-                    if n.get("type") != "LoraInfo"
-                ]
-                workflow = json.dumps(data)
-            except Exception:
-                pass
-
-        exif = img.getexif()
-        if workflow:
-            exif[0x010e] = "Workflow:" + workflow
-
-        img.convert("RGB").save(
-            output_path, "webp",
-            quality=self.quality,
-            method=6,
-            exif=exif
-        )
+            return orig_size, webp_size, None
 
-    def task_finished(self, orig, webp):
-        self.completed += 1
-        self.orig_bytes += orig
-        self.webp_bytes += webp
+        except Exception as e:
+            return 0, 0, f"{os.path.basename(img_path)} → {e}"
 
-        percent = int((self.completed / self.total) * 100)
-        self.progress.emit(percent)
+    # Encoders, one is picked in __init__ so convert_one doesn't branch on
+    # the job options per file. No explicit load(): the encoder pulls the
+    # pixels itself while the file is still open.
 
-        elapsed = time.monotonic() - self.start_time
-        rate = self.completed / elapsed if elapsed else 0
-        remaining = self.total - self.completed
-        eta = remaining / rate if rate else 0
+    def _encode_fast(self, img_path):
+        output_path = self._output_path(img_path)
+        with open_image(img_path) as img:
+            return save_webp(img, output_path, self.quality, self.method)
 
-        self.eta.emit(time.strftime("%H:%M:%S", time.gmtime(eta)))
+    def _encode_resized(self, img_path):
+        output_path = self._output_path(img_path)
+        with open_image(img_path, self.max_dim) as img:
+            img = shrink_image(img, self.max_dim)
+            return save_webp(img, output_path, self.quality, self.method)
 
-        if self.completed == self.total:
-            self.finished.emit({
-                "converted": self.completed,
-                "saved_bytes": self.orig_bytes - self.webp_bytes
-            })
+    def _encode_meta(self, img_path):
+        # fail mis-routed files before opening or decoding anything
+        if not img_path.lower().endswith(".png"):
+            raise ValueError("Workflow requires PNG")
+
+        output_path = self._output_path(img_path)
+        with open_image(img_path, self.max_dim) as img:
+            if self.max_dim:
+                img = shrink_image(img, self.max_dim)
+            return save_with_metadata(img, output_path, self.quality, self.method)
+
+    def _output_path(self, img_path):
+        return self.resolve_name(os.path.splitext(os.path.basename(img_path))[0])
+
+    def resolve_name(self, base):
+        with self._name_lock:
+            name = f"{base}.webp"
+            i = self._suffix[base]
+            if i:
+                name = f"{base}_{i}.webp"
+            while os.path.normcase(name) in self._taken:
+                i += 1
+                name = f"{base}_{i}.webp"
+            self._taken.add(os.path.normcase(name))
+            self._suffix[base] = i
+        return os.path.join(self.output_dir, name)
+
+    def cancel(self):
+        self.cancelled = True
+        # let paused workers see the cancel
+        self._go.set()
+
+    def task_finished(self, converted, failed, orig, webp):
+        with self._counter_lock:
+            self.completed += converted
+            self.failed += failed
+            self.orig_bytes += orig
+            self.webp_bytes += webp
 
     def task_error(self, msg):
         self.error.emit(msg)
@@ -228,6 +450,7 @@ class ImageConverter(QWidget):
         self.delete_originals = QCheckBox("Delete originals")
 
         self.label = QLabel("No images selected")
+        self.backend_label = QLabel(backend_status())
         layout.addWidget(self.input_label)
         layout.addWidget(self.output_label)
         layout.addWidget(QLabel("\n"))
@@ -239,16 +462,29 @@ class ImageConverter(QWidget):
         self.quality_slider.setRange(1, 100)
         self.quality_slider.setValue(87)
 
-        self.quality_slider.valueChanged.connect(
-            lambda v: self.quality_label.setText(f"Quality: {v}")
-        )
+        self.quality_slider.valueChanged.connect(self._on_quality)
+
+
+        # libwebp "method": 4 is its default, 6 is ~3x slower for <1% smaller files
+        self.method = QSpinBox()
+        self.method.setRange(0, 6)
+        self.method.setValue(4)
 
+        self.max_dim = QSpinBox()
+        self.max_dim.setRange(0, 16384)
+        self.max_dim.setSingleStep(64)
+        self.max_dim.setSpecialValueText("Original size")
+        self.max_dim.setSuffix(" px")
 
         self.workers = QSpinBox()
-        self.workers.setRange(1, os.cpu_count() or 1)
+        self.workers.setRange(1, _CPU_COUNT)
 
         self.progress = QProgressBar()
 
+        self._ui_timer = QTimer(self)
+        self._ui_timer.setInterval(100)
+        self._ui_timer.timeout.connect(self._poll_progress)
+
         self.btn_files = QPushButton("Select Images")
         self.btn_output = QPushButton("Select Output")
         self.btn_start = QPushButton("Start")
@@ -261,11 +497,16 @@ class ImageConverter(QWidget):
         layout.addWidget(QLabel("\n"))
         layout.addWidget(self.quality_label)
         layout.addWidget(self.quality_slider)
+        layout.addWidget(QLabel("Compression effort (0 fast – 6 smallest)"))
+        layout.addWidget(self.method)
+        layout.addWidget(QLabel("Max dimension"))
+        layout.addWidget(self.max_dim)
         layout.addWidget(QLabel("Parallel workers"))
         layout.addWidget(self.workers)
         layout.addWidget(self.label)
         layout.addWidget(self.progress)
         layout.addWidget(self.eta_label)
+        layout.addWidget(self.backend_label)
 
         btns = QHBoxLayout()
         for b in (self.btn_files, self.btn_output, self.btn_start,
@@ -284,13 +525,17 @@ class ImageConverter(QWidget):
 
     def _load_settings(self):
         self.quality_slider.setValue(self.settings.value("quality", 87, int))
-        self.workers.setValue(self.settings.value("workers", max(1, (os.cpu_count() or 2) - 1), int))
+        self.workers.setValue(self.settings.value("workers", _CPU_COUNT, int))
+        self.method.setValue(self.settings.value("method", 4, int))
+        self.max_dim.setValue(self.settings.value("max_dim", 0, int))
         self.keep_metadata.setChecked(self.settings.value("keep_meta", False, bool))
         self.delete_originals.setChecked(self.settings.value("delete", False, bool))
 
     def closeEvent(self, e):
         self.settings.setValue("quality", self.quality_slider.value())
         self.settings.setValue("workers", self.workers.value())
+        self.settings.setValue("method", self.method.value())
+        self.settings.setValue("max_dim", self.max_dim.value())
         self.settings.setValue("keep_meta", self.keep_metadata.isChecked())
         self.settings.setValue("delete", self.delete_originals.isChecked())
         super().closeEvent(e)
@@ -328,7 +573,9 @@ class ImageConverter(QWidget):
             self.quality_slider.value(),
             self.keep_metadata.isChecked(),
             self.delete_originals.isChecked(),
-            self.workers.value()
+            self.workers.value(),
+            self.method.value(),
+            self.max_dim.value()
         )
 
         self.btn_pause.setEnabled(True)
@@ -338,18 +585,37 @@ class ImageConverter(QWidget):
 
         self.btn_files.setEnabled(False)
         self.btn_output.setEnabled(False)
-        self.ctrl.progress.connect(self.progress.setValue)
-        self.ctrl.eta.connect(lambda s: self.eta_label.setText(f"ETA: {s}"))
-        self.ctrl.error.connect(lambda m: QMessageBox.warning(self, "Error", m))
+        self.ctrl.error.connect(self._on_error)
         self.ctrl.finished.connect(self.done)
 
         self.ctrl.start()
+        self._ui_timer.start()
         self.btn_start.setEnabled(False)
     
 
+    def _on_quality(self, v):
+        self.quality_label.setText(f"Quality: {v}")
+
+    def _poll_progress(self):
+        # the GUI pulls the counters, workers never signal per file
+        ctrl = self.ctrl
+        # failed files count as processed, or the bar never reaches 100%
+        processed = ctrl.completed + ctrl.failed
+        self.progress.setValue(int((processed / ctrl.total) * 100))
+
+        elapsed = time.monotonic() - ctrl.start_time
+        rate = processed / elapsed if elapsed else 0
+        remaining = ctrl.total - processed
+        eta = int(remaining / rate) if rate else 0
+        self.eta_label.setText(f"ETA: {eta // 3600:02d}:{eta // 60 % 60:02d}:{eta % 60:02d}")
+
+    def _on_error(self, m):
+        QMessageBox.warning(self, "Error", m)
+
     def cancel(self):
         if hasattr(self, "ctrl"):
             self.ctrl.cancel()
+            self._ui_timer.stop()
             self.btn_pause.setEnabled(False)
             self.btn_resume.setEnabled(False)
             self.btn_cancel.setEnabled(False)
@@ -372,8 +638,14 @@ class ImageConverter(QWidget):
 
 
     def done(self, stats):
+        self._ui_timer.stop()
+        self._poll_progress()
+
         saved_gb = round(stats["saved_bytes"] / (1024 ** 3), 2)
-        QMessageBox.information(self, "Done", f"Saved: {saved_gb} GB")
+        msg = f"Saved: {saved_gb} GB"
+        if stats["failed"]:
+            msg += f"\nFailed: {stats['failed']} images"
+        QMessageBox.information(self, "Done", msg)
 
         self.btn_pause.setEnabled(False)
         self.btn_resume.setEnabled(False)